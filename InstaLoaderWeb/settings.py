@@ -11,6 +11,12 @@ import os
 # ----------------------------------------------------
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    """Parse a boolean env toggle ("1", "true", "yes", "on" are truthy)."""
+    return os.environ.get(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+
 # ----------------------------------------------------
 # Core security & environment
 # ----------------------------------------------------
@@ -18,7 +24,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # SECRET_KEY: a long random value
 # DEBUG: "False" (string) in production
 SECRET_KEY = os.environ.get("SECRET_KEY", "dev-insecure-key")
-DEBUG = os.environ.get("DEBUG", "False").lower() == "true"
+DEBUG = _env_bool("DEBUG")
 
 # Render sets this automatically (e.g., "instaloaderweb.onrender.com")
 RENDER_HOST = os.environ.get("RENDER_EXTERNAL_HOSTNAME")
@@ -75,6 +81,9 @@ MIDDLEWARE = [
 # ----------------------------------------------------
 ROOT_URLCONF = "InstaLoaderWeb.urls"
 WSGI_APPLICATION = "InstaLoaderWeb.wsgi.application"
+# Preferred in production so the async views don't block a worker on Instagram:
+#   gunicorn InstaLoaderWeb.asgi:application -k uvicorn.workers.UvicornWorker
+ASGI_APPLICATION = "InstaLoaderWeb.asgi.application"
 
 # ----------------------------------------------------
 # Templates
@@ -126,7 +135,7 @@ USE_I18N = True
 USE_TZ = True
 
 # ----------------------------------------------------
-# Static & Media
+# Static files
 # ----------------------------------------------------
 # Static files served by WhiteNoise
 STATIC_URL = "/static/"
@@ -136,12 +145,29 @@ STATIC_ROOT = BASE_DIR / "staticfiles"  # collectstatic target
 _static_dir = BASE_DIR / "static"
 STATICFILES_DIRS = [_static_dir] if _static_dir.exists() else []
 
-# WhiteNoise compressed manifest storage
-STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
+# WhiteNoise compressed manifest storage (emits .gz + .br when Brotli is installed).
+# Hashed names let WhiteNoise cache them forever; run collectstatic before serving.
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage"},
+}
+
+# Only scan app static dirs on each request in development; prod serves STATIC_ROOT.
+WHITENOISE_USE_FINDERS = DEBUG
+
+# ----------------------------------------------------
+# Downloader app
+# ----------------------------------------------------
+# Render previews via /proxy to avoid IG CDN hotlink issues.
+PREVIEW_VIA_PROXY = _env_bool("PREVIEW_VIA_PROXY", True)
+
+# Behind nginx, set to an internal location (e.g. "/_ig_cdn/") so /proxy answers
+# with X-Accel-Redirect and nginx streams the CDN bytes instead of a Python worker.
+PROXY_ACCEL_REDIRECT = os.environ.get("PROXY_ACCEL_REDIRECT", "")
 
-# Media (be aware: ephemeral on Render)
-MEDIA_URL = "/media/"
-MEDIA_ROOT = BASE_DIR / "media"
+# Bytes per chunk when /proxy streams CDN media. Per-chunk overhead stops
+# mattering past ~100 KiB, so 256 KiB keeps iterations low at little memory cost.
+PROXY_CHUNK_SIZE = int(os.environ.get("PROXY_CHUNK_SIZE", 256 * 1024))
 
 # ----------------------------------------------------
 # Default PK
@@ -156,4 +182,6 @@ LOGGING = {
     "disable_existing_loggers": False,
     "handlers": {"console": {"class": "logging.StreamHandler"}},
     "root": {"handlers": ["console"], "level": "INFO"},
+    # httpx logs every /proxy upstream request at INFO
+    "loggers": {"httpx": {"level": "WARNING"}},
 }
@@ -16,16 +16,9 @@ Including another URLconf
 """
 
 from django.contrib import admin
-from django.urls import path, include, re_path
-from django.conf import settings
-from django.views.static import serve as static_serve
+from django.urls import path, include
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("", include("downloader.urls")),
 ]
-
-# Serve MEDIA files even when DEBUG=False (needed on Render)
-urlpatterns += [
-    re_path(r"^media/(?P<path>.*)$", static_serve, {"document_root": settings.MEDIA_ROOT}),
-]
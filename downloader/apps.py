@@ -1,6 +1,32 @@
+import os
+import sys
+
 from django.apps import AppConfig
 
 
+def _should_prewarm() -> bool:
+    """Warm up only in serving processes, not in migrate/collectstatic/tests/etc."""
+    if "pytest" in sys.modules:
+        return False
+    from django.core.management import get_commands
+
+    subcommand = sys.argv[1] if len(sys.argv) > 1 else ""
+    # manage.py / django-admin / python -m django: judge by the subcommand
+    if subcommand in get_commands():
+        # runserver: only the autoreloaded child (or a --noreload process) serves requests
+        return subcommand == "runserver" and (
+            os.environ.get("RUN_MAIN") == "true" or "--noreload" in sys.argv
+        )
+    # gunicorn / uvicorn / daphne etc.
+    return True
+
+
 class DownloaderConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'downloader'
+
+    def ready(self):
+        # Decode the IG session at worker boot instead of on the first POST.
+        if _should_prewarm():
+            from . import views
+            views._instaloader_with_env()
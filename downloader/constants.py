@@ -0,0 +1,49 @@
+from django.conf import settings
+
+# =========================
+# Config / Feature toggles
+# =========================
+# We render previews via /proxy to avoid IG CDN hotlink issues (env: PREVIEW_VIA_PROXY).
+PREVIEW_VIA_PROXY = getattr(settings, "PREVIEW_VIA_PROXY", True)
+
+# Allow common Instagram/Facebook regional CDN hosts (hostname suffixes;
+# ".fbcdn.net" also covers the regional ".fna.fbcdn.net" hosts).
+ALLOWED_CDN_SUFFIXES = (
+    ".cdninstagram.com",
+    ".fbcdn.net",
+)
+
+# nginx internal location for X-Accel-Redirect offload of /proxy ("" = stream in Django).
+PROXY_ACCEL_REDIRECT = getattr(settings, "PROXY_ACCEL_REDIRECT", "")
+
+# Bytes per chunk when streaming through /proxy (env: PROXY_CHUNK_SIZE).
+PROXY_CHUNK_SIZE = getattr(settings, "PROXY_CHUNK_SIZE", 256 * 1024)
+
+# Carousel images up to this size are prefetched into memory right after a
+# lookup, so the browser's preview requests don't each wait on the CDN.
+PREFETCH_MAX_BYTES = 256 * 1024
+
+# Non-Range image responses up to this size are read in one go and sent as a
+# single buffered body instead of being streamed chunk by chunk.
+PROXY_BUFFER_MAX_BYTES = 4 * 1024 * 1024
+
+# Upper bound (seconds) for browser caching of proxied previews. Signed CDN URLs
+# are immutable until their `oe=` expiry, so an hour is safe.
+PROXY_MAX_AGE = 3600
+
+# Browser cache lifetime (seconds) for proxied image previews. The bytes behind a
+# given post/asset never change, so images can be kept for a day.
+PROXY_IMAGE_MAX_AGE = 86400
+
+# Seconds a resolved post/story's CDN URLs are reused (shared by posts and reels).
+# Signed CDN links carry an `oe=` expiry, so keep this well under their lifetime.
+MEDIA_CACHE_TTL = 300
+
+# Seconds /proxy remembers an asset's type, length and Last-Modified, so Range
+# follow-ups (video scrubbing) need no probe and bad ranges are refused locally.
+ASSET_META_TTL = 300
+
+# Seconds /proxy keeps resolving the (k, t, m, i) links of a page we rendered.
+# Covers a preview tab left open for a while (video scrubbing, late downloads);
+# /proxy itself never starts an Instagram lookup.
+RENDERED_MEDIA_TTL = 3600
@@ -1,3 +1,221 @@
-from django.test import TestCase
+import os
+import sys
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.test import RequestFactory, TestCase, override_settings
+
+from . import views
+from .apps import _should_prewarm
+
+
+def _clear_caches():
+    for cache in (views._MEDIA_CACHE, views._RENDERED, views._ASSET_META, views._PREFETCH):
+        cache.clear()
+    views._INFLIGHT.clear()
+
+
+class ParseIgUrlTests(TestCase):
+    def test_table(self):
+        cases = [
+            ("https://www.instagram.com/p/DQ192xEEdMf/", ("post", "DQ192xEEdMf")),
+            ("https://www.instagram.com/p/DQ192xEEdMf", ("post", "DQ192xEEdMf")),
+            ("https://www.instagram.com/reel/abc_-1/?igsh=xyz", ("post", "abc_-1")),
+            ("http://instagram.com/tv/abc#frag", ("post", "abc")),
+            ("HTTPS://instagram.com/p/abc", ("post", "abc")),
+            ("https://instagram.com/stories/someone/3762806023376780800/", ("story", "3762806023376780800")),
+            ("https://www.instagram.com/stories/highlights/123/?story_media_id=4", ("story", "123")),
+            ("https://www.instagram.com/stories/highlights/123/456/", ("story", "123")),
+            ("https://www.instagram.com/p/abc/extra", (None, None)),
+            ("https://www.instagram.com/stories/someone/notdigits/", (None, None)),
+            ("https://www.instagram.com/", (None, None)),
+            ("https://www.instagram.com", (None, None)),
+            ("instagram.com/p/abc", (None, None)),
+            ("", (None, None)),
+        ]
+        for url, expected in cases:
+            with self.subTest(url=url):
+                self.assertEqual(views._parse_ig_url(url), expected)
+
+    def test_sanitize_rejects_foreign_and_oversized(self):
+        self.assertEqual(views._sanitize_url("  https://instagram.com/p/abc  "), "https://instagram.com/p/abc")
+        self.assertEqual(views._sanitize_url("https://example.com/p/abc"), "")
+        self.assertEqual(views._sanitize_url("https://instagram.com/p/" + "a" * 3000), "")
+
+
+class ParseRangeTests(TestCase):
+    def test_table(self):
+        cases = [
+            ("bytes=0-99", (0, 99)),
+            ("bytes=100-", (100, None)),
+            ("bytes=-500", (None, 500)),
+            (" bytes=5-5 ", (5, 5)),
+            ("bytes=5-1", None),
+            ("bytes=-", None),
+            ("bytes=abc", None),
+            # multi-range and other units are valid HTTP but unsupported: ignored by /proxy
+            ("bytes=0-1,5-6", None),
+            ("items=0-1", None),
+        ]
+        for value, expected in cases:
+            with self.subTest(value=value):
+                self.assertEqual(views._parse_range(value), expected)
+
+
+class ProxyTests(TestCase):
+    SRC = "https://scontent.cdninstagram.com/v/a.mp4?oe=1"
+
+    def setUp(self):
+        _clear_caches()
+
+    def get(self, params, **headers):
+        return self.client.get("/proxy", params, headers=headers, secure=True)
+
+    def test_unsupported_range_is_ignored(self):
+        for rng in ("bytes=abc", "bytes=0-1,5-6", "bytes=5-1", "items=0-1"):
+            with self.subTest(rng=rng):
+                request = RequestFactory().get("/proxy", {"u": self.SRC}, headers={"Range": rng})
+                src, headers, download = views._proxy_prepare(request)
+                self.assertEqual(src, self.SRC)
+                self.assertNotIn("Range", headers)
+
+    def test_range_past_known_length_is_416(self):
+        views._ASSET_META[self.SRC] = {"ctype": "video/mp4", "length": 100, "last_modified": None}
+        resp = self.get({"u": self.SRC}, Range="bytes=100-")
+        self.assertEqual(resp.status_code, 416)
+        self.assertEqual(resp["Content-Range"], "bytes */100")
+
+    def test_if_none_match_any_coding_is_304(self):
+        etag = views._proxy_etag(self.SRC, "gzip")
+        resp = self.get({"u": self.SRC}, If_None_Match=etag)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp["ETag"], etag)
+
+    def test_etag_tracks_variant_not_signature(self):
+        base = "https://scontent.cdninstagram.com/v/a.jpg?stp=dst-jpg_s640x640&_nc_ht=x"
+        resigned = "https://scontent.cdninstagram.com/v/a.jpg?_nc_ht=x&oe=2&stp=dst-jpg_s640x640&oh=zz"
+        other_size = "https://scontent.cdninstagram.com/v/a.jpg?stp=dst-jpg_s1080x1080&_nc_ht=x"
+        self.assertEqual(views._proxy_etag(base), views._proxy_etag(resigned))
+        self.assertNotEqual(views._proxy_etag(base), views._proxy_etag(other_size))
+
+    def test_unrendered_token_never_looks_up(self):
+        with mock.patch.object(views, "_fetch_media") as fetch:
+            resp = self.get({"k": "post", "t": "abc", "m": "i", "i": "0"})
+        self.assertEqual(resp.status_code, 410)
+        fetch.assert_not_called()
+
+    def test_malformed_token_is_400(self):
+        for kind, token in (("post", "abc/../x"), ("post", ""), ("story", "12a"), ("user", "abc")):
+            with self.subTest(kind=kind, token=token):
+                resp = self.get({"k": kind, "t": token, "m": "i", "i": "0"})
+                self.assertEqual(resp.status_code, 400)
+
+    def test_index_out_of_range_is_404(self):
+        views._RENDERED[("post", "abc")] = ([self.SRC], [])
+        self.assertEqual(self.get({"k": "post", "t": "abc", "m": "i", "i": "1"}).status_code, 404)
+        self.assertEqual(self.get({"k": "post", "t": "abc", "m": "v", "i": "0"}).status_code, 404)
+
+
+class ResolveMediaTests(TestCase):
+    def setUp(self):
+        _clear_caches()
+
+    def test_concurrent_misses_share_one_lookup(self):
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def fetch(kind, token):
+            calls.append((kind, token))
+            started.set()
+            release.wait(5)
+            return ["img"], []
+
+        results = []
+        with mock.patch.object(views, "_fetch_media", fetch):
+            threads = [threading.Thread(target=lambda: results.append(views._resolve_media("post", "abc")))]
+            threads[0].start()
+            started.wait(5)
+            for _ in range(4):
+                t = threading.Thread(target=lambda: results.append(views._resolve_media("post", "abc")))
+                threads.append(t)
+                t.start()
+            release.set()
+            for t in threads:
+                t.join(5)
+
+        self.assertEqual(calls, [("post", "abc")])
+        self.assertEqual(results, [(["img"], [])] * 5)
+        self.assertNotIn(("post", "abc"), views._INFLIGHT)
+
+    def test_waiter_timeout_raises_lookup_in_progress(self):
+        views._INFLIGHT[("post", "abc")] = views.Future()
+        with mock.patch.object(views, "INFLIGHT_WAIT_TIMEOUT", 0.01), \
+                mock.patch.object(views, "_fetch_media") as fetch:
+            with self.assertRaises(views.LookupInProgress):
+                views._resolve_media("post", "abc")
+        fetch.assert_not_called()
+
+    def test_empty_result_is_not_cached(self):
+        with mock.patch.object(views, "_fetch_media", return_value=([], [])) as fetch:
+            views._resolve_media("post", "abc")
+            views._resolve_media("post", "abc")
+        self.assertEqual(fetch.call_count, 2)
+
+
+# Templates use {% static %}; the manifest only exists after collectstatic.
+@override_settings(STORAGES={
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+})
+class RenderMediaTests(TestCase):
+    def setUp(self):
+        _clear_caches()
+
+    def test_images_and_videos_are_separate_lists(self):
+        resp = self.client.get("/posts", secure=True)
+        self.assertIsNot(resp.context["images"], resp.context["videos"])
+
+    def test_rendered_post_links_resolve(self):
+        src = "https://scontent.cdninstagram.com/v/a.jpg"
+        with mock.patch.object(views, "_fetch_media", return_value=([src], [])), \
+                mock.patch.object(views, "_prefetch_images"):
+            resp = self.client.post("/posts", {"postURL": "https://www.instagram.com/p/abc/"}, secure=True)
+        self.assertIsNot(resp.context["images"], resp.context["videos"])
+        self.assertEqual(len(resp.context["images"]), 1)
+        self.assertEqual(views._proxy_src({"k": "post", "t": "abc", "m": "i", "i": "0"}), src)
+
+    def test_queued_lookup_shows_retry_message(self):
+        views._INFLIGHT[("post", "abc")] = views.Future()
+        with mock.patch.object(views, "INFLIGHT_WAIT_TIMEOUT", 0.01):
+            resp = self.client.post("/posts", {"postURL": "https://www.instagram.com/p/abc/"}, secure=True)
+        self.assertIn("still being looked up", resp.context["error"])
+
+    def test_reels_rejects_stories(self):
+        with mock.patch.object(views, "_fetch_media") as fetch:
+            resp = self.client.post(
+                "/reels", {"postURL": "https://instagram.com/stories/someone/123/"}, secure=True
+            )
+        self.assertIn("Stories", resp.context["error"])
+        fetch.assert_not_called()
+
+
+class ShouldPrewarmTests(TestCase):
+    def test_table(self):
+        cases = [
+            (["manage.py", "migrate"], None, False),
+            (["/venv/bin/django-admin", "migrate"], None, False),
+            (["/usr/lib/python3/django/__main__.py", "collectstatic"], None, False),
+            (["manage.py", "runserver"], None, False),
+            (["manage.py", "runserver"], "true", True),
+            (["manage.py", "runserver", "--noreload"], None, True),
+            (["/venv/bin/gunicorn", "-w", "4", "InstaLoaderWeb.wsgi"], None, True),
+            (["uvicorn", "InstaLoaderWeb.asgi:application"], None, True),
+        ]
+        for argv, run_main, expected in cases:
+            with self.subTest(argv=argv, run_main=run_main), mock.patch("sys.argv", argv), \
+                    mock.patch.dict("os.environ"), mock.patch.dict("sys.modules"):
+                os.environ.pop("RUN_MAIN", None)
+                if run_main:
+                    os.environ["RUN_MAIN"] = run_main
+                sys.modules.pop("pytest", None)
+                self.assertEqual(_should_prewarm(), expected)
@@ -5,5 +5,6 @@ urlpatterns = [
     path("", views.index, name="index"),
     path("posts", views.posts, name="posts"),
     path("reels", views.reels, name="reels"),
-    path("proxy", views.proxy, name="proxy"),  # keep if you added the proxy view
+    path("allposts", views.allposts, name="allposts"),
+    path("proxy", views.proxy, name="proxy"),
 ]
@@ -1,37 +1,123 @@
+from django.conf import settings
 from django.shortcuts import render
-from django.http import StreamingHttpResponse, HttpResponseBadRequest, HttpResponse
-import os, base64, tempfile, requests, mimetypes, re
+from django.utils.http import parse_http_date_safe
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    StreamingHttpResponse, HttpResponseBadRequest, HttpResponse, HttpResponseNotModified,
+    HttpResponseNotFound, HttpResponseGone,
+)
+from django.http.response import HttpResponseBase
+import os, base64, hashlib, pickle, tempfile, threading, logging, mimetypes, re
+import certifi
+import httpx
+import urllib3
 import instaloader
-from urllib.parse import urlsplit, urlencode
-
-# =========================
-# Config / Feature toggles
-# =========================
-# We render previews via /proxy to avoid IG CDN hotlink issues.
-PREVIEW_VIA_PROXY = os.environ.get("PREVIEW_VIA_PROXY", "true").lower() == "true"
-
-# Allow common Instagram/Facebook regional CDN hosts.
-ALLOWED_CDN_SUBSTRINGS = (
-    ".cdninstagram.com",
-    ".fbcdn.net",
-    ".fna.fbcdn.net",
+from cachetools import TTLCache
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from urllib.parse import urlsplit
+from urllib3.util.retry import Retry
+
+from .constants import (
+    ALLOWED_CDN_SUFFIXES, PROXY_CHUNK_SIZE, PROXY_MAX_AGE,
+    PROXY_ACCEL_REDIRECT, MEDIA_CACHE_TTL, PREFETCH_MAX_BYTES,
+    PROXY_BUFFER_MAX_BYTES, PROXY_IMAGE_MAX_AGE, PREVIEW_VIA_PROXY,
+    RENDERED_MEDIA_TTL, ASSET_META_TTL,
+)
+
+log = logging.getLogger(__name__)
+
+# All supported Instagram paths in one precompiled pattern (see _parse_ig_url):
+#   group 1: /stories/highlights/<mediaid>/...
+#   group 2: /stories/<username>/<mediaid>
+#   group 3: /p|reel|tv/<shortcode>
+_IG_PATH_RE = re.compile(
+    r"^/(?:stories/highlights/(\d+)(?:/.*)?|stories/[^/]+/(\d+)|(?:p|reel|tv)/([A-Za-z0-9_-]+))/?$"
 )
+_SHORTCODE_RE = re.compile(r"[A-Za-z0-9_-]+")
+# Real post/story links are far shorter; anything longer is rejected unparsed.
+_MAX_IG_URL_LEN = 2048
+
+# Shared urllib3 pool for /proxy (WSGI) and prefetch so CDN connections are kept
+# alive instead of paying a fresh TCP + TLS handshake on every (Range) request.
+# Used directly: a requests.Session adds request preparation, cookie merging and
+# hooks per call that a plain byte relay doesn't need.
+_HTTP = urllib3.PoolManager(
+    num_pools=32,
+    maxsize=128,
+    # Same CA bundle requests/httpx use, so TLS works without system CA certs.
+    ca_certs=certifi.where(),
+    # Transient CDN edge errors get two quick retries; a final 5xx is passed through.
+    retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504], raise_on_status=False),
+)
+
+# Async counterpart used by /proxy under ASGI: HTTP/2 lets one connection per
+# CDN host multiplex every Range/sidecar request of a page.
+_AHTTP = httpx.AsyncClient(
+    timeout=20,
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=2,  # connect errors only; httpx has no status-based retries
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    ),
+)
+
+# One Instaloader per process: session decode + test_login happen once, not per POST.
+# Its context isn't thread-safe (every query updates the rate controller's
+# timestamps and the session cookies), so lookups run one at a time under
+# _LOOKUP_LOCK; _resolve_media's coalescing already drops duplicate work.
+_L_SINGLETON: instaloader.Instaloader | None = None
+_L_LOCK = threading.Lock()
+_LOOKUP_LOCK = threading.Lock()
+
+# Resolved (kind, token) -> (img_cdn, vid_cdn); only URL lists are stored, never
+# the Post object (it holds a live Instaloader context).
+_MEDIA_CACHE = TTLCache(maxsize=1024, ttl=MEDIA_CACHE_TTL)
+_MEDIA_CACHE_LOCK = threading.RLock()
+
+# (kind, token) -> Future of the lookup currently in flight, so duplicate
+# concurrent requests wait on it instead of hitting Instagram again.
+# Guarded by _MEDIA_CACHE_LOCK.
+_INFLIGHT: dict[tuple, Future] = {}
+INFLIGHT_WAIT_TIMEOUT = 10  # seconds
+
+# (kind, token) -> (img_cdn, vid_cdn) of pages we actually rendered. /proxy
+# resolves its (k, t, m, i) links only from here, so a bare GET can't make us
+# query Instagram with the owner's session.
+_RENDERED = TTLCache(maxsize=2048, ttl=RENDERED_MEDIA_TTL)
+_RENDERED_LOCK = threading.Lock()
+
+# Single-range `Range: bytes=start-end` / `bytes=-suffix`; anything else is ignored.
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+# Signed-URL params that rotate on every lookup without changing the bytes (see _proxy_etag).
+_SIGNATURE_PARAMS = frozenset({"oe", "oh"})
+# max-age directive of an upstream Cache-Control (see _preview_cache_control).
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+# CDN URL -> {"ctype", "length", "last_modified"}, learned from the first
+# upstream response so follow-up Range requests (video scrubbing) don't need a
+# probe: out-of-bounds ranges are refused locally and missing headers filled in.
+_ASSET_META = TTLCache(maxsize=1024, ttl=ASSET_META_TTL)
+_ASSET_META_LOCK = threading.Lock()
+
+# Small images warmed right after a lookup: CDN URL -> (upstream headers, body).
+# Short TTL since it only needs to bridge the page render -> preview requests gap.
+_PREFETCH = TTLCache(maxsize=64, ttl=60)
+_PREFETCH_LOCK = threading.Lock()
+_PREFETCH_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="ig-prefetch")
 
 # =================
 # Helper functions
 # =================
 
 def _sanitize_url(url: str) -> str:
-    """Trim & strip query/fragment noise from an Instagram URL."""
+    """Trim an Instagram URL; query/fragment are ignored later by _parse_ig_url."""
     if not url:
         return ""
     url = url.strip()
-    if "instagram.com" not in url:
+    if len(url) > _MAX_IG_URL_LEN or "instagram.com" not in url:
         return ""
-    parts = urlsplit(url)
-    # remove ?query and #fragment
-    clean = f"{parts.scheme}://{parts.netloc}{parts.path}"
-    return clean.rstrip("/")
+    return url
 
 def _parse_ig_url(url: str):
     """
@@ -50,26 +136,21 @@ def _parse_ig_url(url: str):
     """
     if not url:
         return (None, None)
-    path = urlsplit(url).path.rstrip("/")
-
-    # stories/<username>/<mediaid>
-    m = re.match(r"^/stories/[^/]+/(\d+)$", path)
-    if m:
-        return ("story", m.group(1))
-
-    # stories/highlights/<mediaid>/...
-    m = re.match(r"^/stories/highlights/(\d+)(?:/.*)?$", path)
-    if m:
-        return ("story", m.group(1))
-
-    # post / reel / tv
-    m = re.match(r"^/(p|reel|tv)/([^/]+)$", path)
-    if m:
-        return ("post", m.group(2))
-
-    return (None, None)
+    parts = url.split("/", 3)
+    if len(parts) == 4 and parts[0] in ("https:", "http:") and not parts[1] and "?" not in url and "#" not in url:
+        # plain "https://host/path": a bounded split is all urlsplit would do
+        path = "/" + parts[3]
+    else:
+        path = urlsplit(url).path
+    m = _IG_PATH_RE.match(path)
+    if not m:
+        return (None, None)
+    story_id = m.group(1) or m.group(2)
+    if story_id:
+        return ("story", story_id)
+    return ("post", m.group(3))
 
-def _instaloader_with_env() -> instaloader.Instaloader:
+def _build_instaloader() -> instaloader.Instaloader:
     """Configure Instaloader and load session from IG_SESSION_B64 if provided."""
     L = instaloader.Instaloader(
         download_comments=False,
@@ -81,38 +162,51 @@ def _instaloader_with_env() -> instaloader.Instaloader:
     session_b64 = os.environ.get("IG_SESSION_B64")
 
     if session_b64:
-        tmp = tempfile.NamedTemporaryFile(delete=False)
-        tmp.write(base64.b64decode(session_b64))
-        tmp.flush(); tmp.close()
         try:
-            L.load_session_from_file(user, tmp.name)
-            print("Instaloader version:", instaloader.__version__)
-            print("[instaloader] test_login:", L.test_login())
-            print(f"[instaloader] loaded session for {user} (decoded from base64)")
+            raw = base64.b64decode(session_b64)
+            if hasattr(L, "load_session"):
+                # The session file Instaloader writes is a pickled cookie dict,
+                # so decode it in memory instead of round-tripping through a temp file.
+                L.load_session(user, pickle.loads(raw))
+            else:
+                # instaloader < 4.10 can only load from a file; don't leave it behind.
+                with tempfile.NamedTemporaryFile() as tmp:
+                    tmp.write(raw)
+                    tmp.flush()
+                    L.load_session_from_file(user, tmp.name)
+            log.info("instaloader version: %s", instaloader.__version__)
+            # test_login() is an extra IG round-trip; only worth it while debugging.
+            # A bad session surfaces on the first real lookup anyway.
+            if settings.DEBUG:
+                log.info("[instaloader] test_login: %s", L.test_login())
+            log.info("[instaloader] loaded session for %s (decoded from base64)", user)
         except Exception as e:
-            print(f"[instaloader] session load failed: {e}")
+            log.warning("[instaloader] session load failed: %s", e)
     return L
 
+def _instaloader_with_env() -> instaloader.Instaloader:
+    """Return the process-wide Instaloader, building it (and its session) once."""
+    global _L_SINGLETON
+    if _L_SINGLETON is None:
+        with _L_LOCK:
+            if _L_SINGLETON is None:
+                _L_SINGLETON = _build_instaloader()
+    return _L_SINGLETON
+
 def _collect_post_cdn_urls(post: instaloader.Post):
-    """Return (images, videos) CDN URLs for posts/reels/TV (incl. sidecar)."""
-    imgs, vids = [], []
-    try:
-        if post.typename == "GraphSidecar":
-            for node in post.get_sidecar_nodes():
-                if node.is_video and node.video_url:
-                    vids.append(node.video_url)
-                elif not node.is_video and node.display_url:
-                    imgs.append(node.display_url)
-        else:
-            if post.is_video and getattr(post, "video_url", None):
-                vids.append(post.video_url)
-            elif getattr(post, "url", None):
-                imgs.append(post.url)
-    except Exception as e:
-        print(f"[collect_post_cdn_urls] error: {e}")
-    # de-dup
-    imgs = list(dict.fromkeys(imgs))
-    vids = list(dict.fromkeys(vids))
+    """Return (images, videos) CDN URLs for posts/reels/TV (incl. sidecar); raises on lookup errors."""
+    if post.typename == "GraphSidecar":
+        pairs = [
+            (n.is_video, n.video_url if n.is_video else n.display_url)
+            for n in post.get_sidecar_nodes()
+        ]
+    elif post.is_video and getattr(post, "video_url", None):
+        pairs = [(True, post.video_url)]
+    else:
+        pairs = [(False, getattr(post, "url", None))]
+    # de-dup, keeping carousel order
+    imgs = list(dict.fromkeys(u for is_video, u in pairs if u and not is_video))
+    vids = list(dict.fromkeys(u for is_video, u in pairs if u and is_video))
     return imgs, vids
 
 def _collect_story_cdn_urls(L: instaloader.Instaloader, media_id: str):
@@ -125,25 +219,312 @@ def _collect_story_cdn_urls(L: instaloader.Instaloader, media_id: str):
         elif getattr(item, "url", None):
             imgs.append(item.url)
     except Exception as e:
-        print(f"[collect_story_cdn_urls] error: {e}")
+        log.warning("[collect_story_cdn_urls] error: %s", e)
     return imgs, vids
 
-def _make_media_pairs(urls: list[str]) -> list[dict]:
+def _fetch_media(kind: str, token: str):
+    """Look up (images, videos) CDN URLs on Instagram (uncached, blocking, serialised)."""
+    L = _instaloader_with_env()
+    with _LOOKUP_LOCK:
+        if kind == "post":
+            post = instaloader.Post.from_shortcode(L.context, token)
+            try:
+                return _collect_post_cdn_urls(post)
+            except Exception as e:
+                log.warning("[collect_post_cdn_urls] error: %s", e)
+                return [], []
+        return _collect_story_cdn_urls(L, token)
+
+class LookupInProgress(Exception):
+    """A coalesced waiter gave up while the shared lookup is still queued or running."""
+
+def _resolve_media(kind: str, token: str, use_cache: bool = True):
+    """
+    Return (images, videos) CDN URLs for a parsed URL.
+    Served from the TTL cache when possible; concurrent misses for the same
+    (kind, token) share a single Instagram lookup.
+    """
+    key = (kind, token)
+    if not use_cache:
+        return _fetch_media(kind, token)
+
+    with _MEDIA_CACHE_LOCK:
+        hit = _MEDIA_CACHE.get(key)
+        if hit is not None:
+            return hit
+        fut = _INFLIGHT.get(key)
+        leader = fut is None
+        if leader:
+            fut = _INFLIGHT[key] = Future()
+
+    if not leader:
+        try:
+            return fut.result(timeout=INFLIGHT_WAIT_TIMEOUT)
+        except FutureTimeout:
+            # lookups are serialised, so the leader may still be waiting for its turn
+            raise LookupInProgress() from None
+
+    try:
+        img_cdn, vid_cdn = _fetch_media(kind, token)
+    except Exception as e:
+        with _MEDIA_CACHE_LOCK:
+            _INFLIGHT.pop(key, None)
+        fut.set_exception(e)
+        raise
+
+    with _MEDIA_CACHE_LOCK:
+        # Don't cache empty results: they usually mean login-required / rate-limited.
+        if img_cdn or vid_cdn:
+            _MEDIA_CACHE[key] = (img_cdn, vid_cdn)
+        _INFLIGHT.pop(key, None)
+    fut.set_result((img_cdn, vid_cdn))
+    return img_cdn, vid_cdn
+
+def _prefetch_one(url: str) -> None:
+    """Fetch a small CDN image into _PREFETCH (warms the connection pool either way)."""
+    try:
+        r = _HTTP.request(
+            "GET", url, headers={"Accept-Encoding": "identity"},
+            preload_content=False, decode_content=False, timeout=10,
+        )
+        try:
+            length = r.headers.get("Content-Length") or ""
+            if r.status != 200 or not length.isdigit() or int(length) > PREFETCH_MAX_BYTES:
+                return
+            body = r.read()
+            _remember_asset_meta(url, r.status, r.headers)
+            with _PREFETCH_LOCK:
+                _PREFETCH[url] = (r.headers.copy(), body)
+        finally:
+            _release(r)
+    except Exception as e:
+        log.debug("prefetch failed for %s: %s", url, e)
+
+def _prefetch_images(urls: list[str]) -> None:
+    """Warm carousel images in the background so their previews are served from memory."""
+    if PROXY_ACCEL_REDIRECT or not PREVIEW_VIA_PROXY:
+        return  # nginx / the browser fetches the bytes, nothing to warm in this process
+    for u in urls:
+        with _PREFETCH_LOCK:
+            if u in _PREFETCH:
+                continue
+        _PREFETCH_POOL.submit(_prefetch_one, u)
+
+# Bound once at import: previews go through /proxy, or straight to the CDN
+# when PREVIEW_VIA_PROXY is off. Downloads always use /proxy (attachment header).
+_preview_href = (lambda base, url: base) if PREVIEW_VIA_PROXY else (lambda base, url: url)
+
+def _make_media_pairs(kind: str, token: str, media: str, urls: list[str]) -> list[dict]:
     """
     Build list of dicts for template:
-      [{"preview": "/proxy?...download=0", "download": "/proxy?...download=1"}, ...]
+      [{"preview": "/proxy?k=post&t=<shortcode>&m=i&i=0", "download": "...&download=1"}, ...]
+    Links reference the parsed URL + asset index (media "i" = image, "v" = video);
+    /proxy resolves the CDN URL from _RENDERED, so signed CDN URLs never reach the page
+    (unless PREVIEW_VIA_PROXY is off, which hotlinks previews directly).
+    Previews omit download=0 (the default) to keep URLs and cache keys short.
     """
-    items: list[dict] = []
-    for u in urls or []:
-        q_prev = urlencode({"u": u, "download": "0"})
-        q_dl   = urlencode({"u": u, "download": "1"})
-        items.append({"preview": f"/proxy?{q_prev}", "download": f"/proxy?{q_dl}"})
-    return items
+    prefix = f"/proxy?k={kind}&t={token}&m={media}&i="
+    return [
+        {"preview": _preview_href(f"{prefix}{i}", url), "download": f"{prefix}{i}&download=1"}
+        for i, url in enumerate(urls or ())
+    ]
+
+def _proxy_src(params):
+    """
+    CDN URL a /proxy request refers to: an explicit ?u=, or (k, t, m, i) looked
+    up in _RENDERED. Returns an error response for unknown or stale links.
+    """
+    if params.get("u"):
+        return params["u"]
+    kind, token, media, idx = (params.get(k, "") for k in ("k", "t", "m", "i"))
+    if media not in ("i", "v") or not idx.isdigit():
+        return HttpResponseBadRequest("Missing url")
+    # same token shapes _parse_ig_url accepts; anything else can't be a rendered link
+    if not ((kind == "story" and token.isdigit()) or (kind == "post" and _SHORTCODE_RE.fullmatch(token))):
+        return HttpResponseBadRequest("Invalid media token")
+    with _RENDERED_LOCK:
+        hit = _RENDERED.get((kind, token))
+    if hit is None:
+        return HttpResponseGone("Link expired; look the post up again.")
+    urls = hit[0] if media == "i" else hit[1]
+    if int(idx) >= len(urls):
+        return HttpResponseNotFound("No such media item")
+    return urls[int(idx)]
+
+def _release(r: urllib3.BaseHTTPResponse) -> None:
+    """Done with an upstream response: a fully read connection is already back in
+    the pool; one abandoned mid-body is closed rather than reused."""
+    r.close()
+    r.release_conn()
+
+def _stream_and_close(r: urllib3.BaseHTTPResponse, chunk_size: int = PROXY_CHUNK_SIZE):
+    """Yield the raw upstream body, releasing the pooled connection when done or aborted."""
+    try:
+        yield from r.stream(chunk_size, decode_content=False)
+    finally:
+        _release(r)
+
+async def _astream_and_close(r: httpx.Response, chunk_size: int = PROXY_CHUNK_SIZE):
+    """Async twin of _stream_and_close for the httpx client."""
+    try:
+        async for chunk in r.aiter_raw(chunk_size):
+            yield chunk
+    finally:
+        await r.aclose()
+
+def _preview_cache_control(upstream: str, ctype: str = "") -> str:
+    """
+    Long-lived Cache-Control for previews: a day for images, otherwise the
+    upstream max-age (if any) capped at PROXY_MAX_AGE.
+    """
+    if ctype.startswith("image/"):
+        return f"public, max-age={PROXY_IMAGE_MAX_AGE}, immutable"
+    max_age = PROXY_MAX_AGE
+    m = _MAX_AGE_RE.search(upstream or "")
+    if m and int(m.group(1)) > 0:
+        max_age = min(int(m.group(1)), PROXY_MAX_AGE)
+    return f"public, max-age={max_age}, immutable"
+
+def _cacheable(cache_control: str) -> bool:
+    """True if an upstream Cache-Control already lets browsers keep the response."""
+    cc = cache_control.lower()
+    return "max-age" in cc and "no-store" not in cc and "no-cache" not in cc
+
+def _proxy_etag(src: str, encoding: str | None = None) -> str:
+    """
+    Stable validator for a CDN asset: hashes the path plus every query param
+    except the rotating signature (oe=/oh=), so size/crop variants (stp=, ...)
+    get distinct tags. Encoded bodies get their content-coding appended, so
+    each coding has its own strong ETag.
+    """
+    parts = urlsplit(src)
+    query = "&".join(sorted(
+        p for p in parts.query.split("&") if p and p.partition("=")[0] not in _SIGNATURE_PARAMS
+    ))
+    tag = hashlib.sha1(f"{parts.path}?{query}".encode()).hexdigest()[:16]
+    if encoding and encoding != "identity":
+        tag += "-" + "".join(encoding.split()).replace(",", "+")
+    return f'"{tag}"'
+
+def _not_modified(src: str, last_modified: str | None = None, etag: str | None = None) -> HttpResponseNotModified:
+    resp = HttpResponseNotModified()
+    resp["ETag"] = etag or _proxy_etag(src)
+    if last_modified:
+        resp["Last-Modified"] = last_modified
+    resp["Vary"] = "Range, Accept-Encoding"
+    return resp
+
+def _etag_match(if_none_match: str, src: str) -> str | None:
+    """Our ETag for src (any content-coding) listed in If-None-Match, else None."""
+    base = _proxy_etag(src)
+    for tag in if_none_match.split(","):
+        tag = tag.strip().removeprefix("W/")
+        if tag == "*":
+            return base
+        if tag == base or tag.startswith(base[:-1] + "-"):
+            return tag
+    return None
+
+def _parse_range(value: str):
+    """Parse a single byte Range header into (start, end), either may be None; None if malformed or unsupported."""
+    m = _RANGE_RE.match(value.strip())
+    if not m or not (m.group(1) or m.group(2)):
+        return None
+    start = int(m.group(1)) if m.group(1) else None
+    end = int(m.group(2)) if m.group(2) else None
+    if start is not None and end is not None and end < start:
+        return None
+    return (start, end)
+
+def _remember_asset_meta(src: str, status: int, headers) -> None:
+    """Record type, total size and Last-Modified of an upstream asset from a 200/206."""
+    total = None
+    if status == 206:
+        total = (headers.get("Content-Range") or "").rpartition("/")[2]
+    elif status == 200:
+        total = headers.get("Content-Length")
+    if not (total and total.isdigit()):
+        return
+    if headers.get("Content-Encoding", "identity") != "identity":
+        return  # encoded size, not the file length Range checks need
+    with _ASSET_META_LOCK:
+        _ASSET_META[src] = {
+            "ctype": headers.get("Content-Type"),
+            "length": int(total),
+            "last_modified": headers.get("Last-Modified"),
+        }
+
+def _asset_meta(src: str):
+    with _ASSET_META_LOCK:
+        return _ASSET_META.get(src)
+
+def _range_not_satisfiable(length=None) -> HttpResponse:
+    resp = HttpResponse(status=416)
+    if length is not None:
+        resp["Content-Range"] = f"bytes */{length}"
+    return resp
+
+def _accel_redirect_response(src: str, download: bool) -> HttpResponse:
+    """Hand the CDN fetch to nginx via X-Accel-Redirect (location block: see README)."""
+    parts = urlsplit(src)
+    filename = os.path.basename(parts.path) or "file"
+    target = f"{PROXY_ACCEL_REDIRECT.rstrip('/')}/{parts.hostname}{parts.path}"
+    if parts.query:
+        # signed CDN params (oh=, oe=, ...) must survive the redirect
+        target += f"?{parts.query}"
+
+    ctype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    resp = HttpResponse(content_type=ctype)
+    resp["X-Accel-Redirect"] = target
+    resp["ETag"] = _proxy_etag(src)
+    if download:
+        resp["Content-Disposition"] = f'attachment; filename="{filename}"'
+    # nginx fetches the bytes later, so there's no upstream policy to defer to
+    resp["Cache-Control"] = _preview_cache_control(None, ctype)
+    return resp
+
+def _proxy_content_type(src: str, up_headers, meta) -> str:
+    filename = os.path.basename(urlsplit(src).path) or "file"
+    return (
+        up_headers.get("Content-Type")
+        or (meta and meta["ctype"])
+        or mimetypes.guess_type(filename)[0]
+        or "application/octet-stream"
+    )
+
+def _finish_proxy_response(resp, src: str, up_headers, meta, download: bool):
+    """Copy upstream headers onto a /proxy response and apply our caching/download policy."""
+    filename = os.path.basename(urlsplit(src).path) or "file"
+
+    # Forward useful headers
+    for h in ("Content-Length", "Content-Range", "Content-Encoding", "Accept-Ranges", "Last-Modified", "Cache-Control"):
+        if h in up_headers:
+            resp[h] = up_headers[h]
+    # Always advertise range support so browsers can scrub videos
+    resp.setdefault("Accept-Ranges", "bytes")
+    # Our own stable ETag (see _proxy_etag) so revalidation never needs the CDN
+    resp["ETag"] = _proxy_etag(src, up_headers.get("Content-Encoding"))
+    # Some CDN edges drop validators on partial responses; reuse what we learned
+    if meta and meta["last_modified"]:
+        resp.setdefault("Last-Modified", meta["last_modified"])
+
+    # Force attachment only when requested
+    if download:
+        resp["Content-Disposition"] = f'attachment; filename="{filename}"'
+    # Downloads keep a usable upstream policy; previews (and no-store downloads) get ours
+    if not download or not _cacheable(resp.get("Cache-Control", "")):
+        resp["Cache-Control"] = _preview_cache_control(up_headers.get("Cache-Control"), resp["Content-Type"])
+
+    # Range/full and differently-encoded responses must be cached separately
+    resp["Vary"] = "Range, Accept-Encoding"
+
+    return resp
 
 def _host_allowed(url: str) -> bool:
     try:
         host = (urlsplit(url).hostname or "").lower()
-        return any(sub in host for sub in ALLOWED_CDN_SUBSTRINGS)
+        # single C-level check; also rejects look-alikes such as "x.fbcdn.net.evil.com"
+        return host.endswith(ALLOWED_CDN_SUFFIXES)
     except Exception:
         return False
 
@@ -154,12 +535,10 @@ def _host_allowed(url: str) -> bool:
 def index(request):
     return render(request, "downloader/index.html")
 
-def posts(request):
+async def _render_media(request, template: str, allow_story: bool):
     """
-    One box handles:
-      - Post/Reel/TV URLs
-      - Stories & Highlights URLs
-    Renders proxied preview + single Download button.
+    Shared body of the lookup pages: parse the submitted URL, resolve its CDN
+    URLs and render proxied preview + single Download button per item.
     """
     images = []
     videos = []
@@ -171,113 +550,216 @@ def posts(request):
         kind, token = _parse_ig_url(cleaned)
 
         if not kind or not token:
-            return render(request, "downloader/posts.html", {"error": "Invalid or unsupported Instagram URL."})
+            return render(request, template, {"error": "Invalid or unsupported Instagram URL."})
+        if kind == "story" and not allow_story:
+            return render(request, template, {"error": "Stories aren't supported here; use the Posts page."})
 
         try:
-            print("FINDING MEDIA")
-            L = _instaloader_with_env()
-
-            if kind == "post":
-                post = instaloader.Post.from_shortcode(L.context, token)
-                img_cdn, vid_cdn = _collect_post_cdn_urls(post)
-            else:
-                img_cdn, vid_cdn = _collect_story_cdn_urls(L, token)
-
-            print("CDN URLS:", img_cdn, vid_cdn)
-
-            images = _make_media_pairs(img_cdn)
-            videos = _make_media_pairs(vid_cdn)
+            log.debug("finding media kind=%s token=%s", kind, token)
+            # ?nocache=1 forces a fresh Instagram lookup (debugging aid)
+            use_cache = request.GET.get("nocache") != "1"
+            # Instaloader is blocking; run it off the event loop so one worker can
+            # keep serving other requests while Instagram responds.
+            img_cdn, vid_cdn = await sync_to_async(_resolve_media, thread_sensitive=False)(
+                kind, token, use_cache=use_cache
+            )
+
+            log.debug("cdn urls img=%s vid=%s", img_cdn, vid_cdn)
+            if img_cdn or vid_cdn:
+                with _RENDERED_LOCK:
+                    _RENDERED[(kind, token)] = (img_cdn, vid_cdn)
+            _prefetch_images(img_cdn)
+
+            images = _make_media_pairs(kind, token, "i", img_cdn)
+            videos = _make_media_pairs(kind, token, "v", vid_cdn)
 
             if not (img_cdn or vid_cdn):
                 error = "Could not obtain media URLs. Login may be required or rate-limited."
+        except LookupInProgress:
+            error = "This link is still being looked up. Please try again in a moment."
         except Exception as e:
             error = f"An error occurred: {e}"
 
     return render(
         request,
-        "downloader/posts.html",
+        template,
         {"data": bool(images or videos), "images": images, "videos": videos, "error": error},
     )
 
-def reels(request):
-    """Keeps a separate page if you still link to /reels; same handling as /posts."""
-    images = []
-    videos = []
-    error = None
-
-    if request.method == "POST":
-        raw = (request.POST.get("postURL") or "").strip()
-        cleaned = _sanitize_url(raw)
-        kind, token = _parse_ig_url(cleaned)
-
-        if not kind or not token:
-            return render(request, "downloader/reels.html", {"error": "Invalid or unsupported Instagram URL."})
-
-        try:
-            print("FINDING MEDIA")
-            L = _instaloader_with_env()
-            if kind == "post":
-                post = instaloader.Post.from_shortcode(L.context, token)
-                img_cdn, vid_cdn = _collect_post_cdn_urls(post)
-            else:
-                img_cdn, vid_cdn = _collect_story_cdn_urls(L, token)
-
-            print("CDN URLS:", img_cdn, vid_cdn)
-            images = _make_media_pairs(img_cdn)
-            videos = _make_media_pairs(vid_cdn)
+async def posts(request):
+    """
+    One box handles:
+      - Post/Reel/TV URLs
+      - Stories & Highlights URLs
+    """
+    return await _render_media(request, "downloader/posts.html", allow_story=True)
 
-            if not (img_cdn or vid_cdn):
-                error = "Could not obtain media URLs. Login may be required or rate-limited."
-        except Exception as e:
-            error = f"An error occurred: {e}"
+async def reels(request):
+    """Keeps a separate page if you still link to /reels; post/reel/TV URLs only."""
+    return await _render_media(request, "downloader/reels.html", allow_story=False)
 
-    return render(
-        request,
-        "downloader/reels.html",
-        {"data": bool(images or videos), "images": images, "videos": videos, "error": error},
-    )
+def allposts(request):
+    """Whole-account download page; bulk downloads aren't served by the proxy-based app."""
+    error = None
+    if request.method == "POST":
+        error = "Downloading every post of an account is not supported here. Use /posts with a post URL."
+    return render(request, "downloader/allposts.html", {"error": error})
 
 # ===========================
 # Proxy endpoint (preview & DL)
 # ===========================
 
-def proxy(request):
+def _proxy_prepare(request):
     """
-    Stream a remote Instagram CDN file via same-origin.
-    - Supports HTTP Range (video scrubbing)
-    - Forces download only when ?download=1
+    Everything /proxy does before talking to the CDN (in-memory only, never blocks).
+    Returns either a finished HttpResponse or (src, upstream_headers, download).
     """
-    src = request.GET.get("u")
-    if not src:
-        return HttpResponseBadRequest("Missing url")
+    src = _proxy_src(request.GET)
+    if isinstance(src, HttpResponseBase):
+        return src
     if not _host_allowed(src):
         return HttpResponseBadRequest("Host not allowed")
 
-    headers = {}
-    if "Range" in request.headers:
-        headers["Range"] = request.headers["Range"]
+    # Identity unless the client's Accept-Encoding is passed through below.
+    headers = {"Accept-Encoding": "identity"}
+
+    # Browser revalidating something it already has: answer without touching the CDN
+    if "If-None-Match" in request.headers:
+        etag = _etag_match(request.headers["If-None-Match"], src)
+        if etag:
+            return _not_modified(src, etag=etag)
+    elif "If-Modified-Since" in request.headers:
+        ims = request.headers["If-Modified-Since"]
+        meta = _asset_meta(src)
+        if meta and meta["last_modified"]:
+            since = parse_http_date_safe(ims)
+            modified = parse_http_date_safe(meta["last_modified"])
+            if since and modified and modified <= since:
+                return _not_modified(src, meta["last_modified"])
+        else:
+            # unknown asset: let the CDN decide (a 304 from it is passed through)
+            headers["If-Modified-Since"] = ims
+    # Multi-range or malformed Range headers are ignored and the full body is
+    # served (RFC 9110 §14.2); only a start past a known length is a 416.
+    rng = request.headers.get("Range")
+    parsed = _parse_range(rng) if rng else None
+    if parsed:
+        meta = _asset_meta(src)
+        if meta and parsed[0] is not None and parsed[0] >= meta["length"]:
+            return _range_not_satisfiable(meta["length"])
+        headers["Range"] = rng
+    else:
+        # Bytes are relayed undecoded with Content-Encoding forwarded, so the
+        # client's own Accept-Encoding can go upstream. Ranges stay on identity
+        # so offsets refer to the file itself.
+        headers["Accept-Encoding"] = request.headers.get("Accept-Encoding") or "identity"
+
+    download = request.GET.get("download") == "1"
+
+    # Behind nginx: let it copy the bytes instead of tying up this worker
+    if PROXY_ACCEL_REDIRECT:
+        return _accel_redirect_response(src, download)
+
+    # Small image already warmed by _prefetch_images: answer from memory
+    if "Range" not in headers:
+        with _PREFETCH_LOCK:
+            hit = _PREFETCH.get(src)
+        if hit:
+            up_headers, body = hit
+            resp = HttpResponse(body, content_type=_proxy_content_type(src, up_headers, None))
+            return _finish_proxy_response(resp, src, up_headers, None, download)
+
+    return src, headers, download
+
+def _should_buffer(status: int, ctype: str, up_headers) -> bool:
+    """Small full-body images are sent in one write instead of being streamed."""
+    length = up_headers.get("Content-Length") or ""
+    return (
+        status == 200
+        and ctype.startswith("image/")
+        and length.isdigit()
+        and int(length) <= PROXY_BUFFER_MAX_BYTES
+    )
+
+def _proxy_sync(request):
+    """WSGI flavour of /proxy: blocking fetch through the shared urllib3 pool."""
+    prep = _proxy_prepare(request)
+    if isinstance(prep, HttpResponseBase):
+        return prep
+    src, headers, download = prep
 
     try:
-        r = requests.get(src, stream=True, timeout=20, headers=headers)
+        r = _HTTP.request(
+            "GET", src, headers=headers,
+            preload_content=False, decode_content=False, timeout=20,
+        )
     except Exception as e:
         return HttpResponseBadRequest(f"Fetch failed: {e}")
 
-    if r.status_code not in (200, 206):
-        return HttpResponse(f"Upstream returned {r.status_code}", status=r.status_code)
-
-    path = urlsplit(src).path
-    filename = os.path.basename(path) or "file"
-    ctype = r.headers.get("Content-Type") or mimetypes.guess_type(filename)[0] or "application/octet-stream"
-
-    resp = StreamingHttpResponse(r.iter_content(8192), content_type=ctype, status=r.status_code)
+    if r.status == 304:
+        _release(r)
+        etag = _proxy_etag(src, r.headers.get("Content-Encoding"))
+        return _not_modified(src, r.headers.get("Last-Modified"), etag)
+    if r.status not in (200, 206):
+        _release(r)
+        return HttpResponse(f"Upstream returned {r.status}", status=r.status)
+    meta = _asset_meta(src)
+    _remember_asset_meta(src, r.status, r.headers)
+    ctype = _proxy_content_type(src, r.headers, meta)
+
+    if _should_buffer(r.status, ctype, r.headers):
+        # Small image: one upstream read, one write, and the connection goes
+        # straight back to the pool instead of per-chunk Python iteration.
+        try:
+            body = r.read()
+        finally:
+            _release(r)
+        resp = HttpResponse(body, content_type=ctype)
+    else:
+        resp = StreamingHttpResponse(_stream_and_close(r), content_type=ctype, status=r.status)
+    return _finish_proxy_response(resp, src, r.headers, meta, download)
+
+async def _proxy_async(request):
+    """ASGI flavour of /proxy: non-blocking fetch + stream through the shared httpx client."""
+    prep = _proxy_prepare(request)
+    if isinstance(prep, HttpResponseBase):
+        return prep
+    src, headers, download = prep
 
-    # Forward useful headers
-    for h in ("Content-Length", "Content-Range", "Accept-Ranges", "ETag", "Last-Modified", "Cache-Control"):
-        if h in r.headers:
-            resp[h] = r.headers[h]
+    try:
+        r = await _AHTTP.send(_AHTTP.build_request("GET", src, headers=headers), stream=True)
+    except httpx.HTTPError as e:
+        return HttpResponseBadRequest(f"Fetch failed: {e}")
 
-    # Force attachment only when requested
-    if request.GET.get("download") == "1":
-        resp["Content-Disposition"] = f'attachment; filename="{filename}"'
+    if r.status_code == 304:
+        await r.aclose()
+        etag = _proxy_etag(src, r.headers.get("Content-Encoding"))
+        return _not_modified(src, r.headers.get("Last-Modified"), etag)
+    if r.status_code not in (200, 206):
+        await r.aclose()
+        return HttpResponse(f"Upstream returned {r.status_code}", status=r.status_code)
+    meta = _asset_meta(src)
+    _remember_asset_meta(src, r.status_code, r.headers)
+    ctype = _proxy_content_type(src, r.headers, meta)
 
-    return resp
+    if _should_buffer(r.status_code, ctype, r.headers):
+        try:
+            body = b"".join([chunk async for chunk in r.aiter_raw()])
+        finally:
+            await r.aclose()
+        resp = HttpResponse(body, content_type=ctype)
+    else:
+        resp = StreamingHttpResponse(_astream_and_close(r), content_type=ctype, status=r.status_code)
+    return _finish_proxy_response(resp, src, r.headers, meta, download)
+
+async def proxy(request):
+    """
+    Stream a remote Instagram CDN file via same-origin.
+    - Supports HTTP Range (video scrubbing)
+    - Forces download only when ?download=1
+    Under ASGI the CDN stream never blocks a worker thread. WSGI servers can't
+    serve async iterators without buffering, so they get the blocking flavour.
+    """
+    if isinstance(request, ASGIRequest):
+        return await _proxy_async(request)
+    return await sync_to_async(_proxy_sync, thread_sensitive=False)(request)